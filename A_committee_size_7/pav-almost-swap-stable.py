@@ -1,57 +1,83 @@
 # Verify Remark 4.2 that for k <= 7, every epsilon-local-swap
 # PAV committee is in the core.
 
-from gurobipy import Env, Model, GRB, quicksum
-import itertools
-from functools import cache
-from utility_functions import powerset, show, generate_wlog_partition, is_wlog, harmonic_number, utility, committees_obtained_by_swap
+from gurobipy import Env, Model, GRB, LinExpr, quicksum
+import numpy as np
+from utility_functions import powerset_masks, show, generate_wlog_partition, canonical_subsets, HARMONIC_NUMBERS, to_mask, from_mask, committees_obtained_by_swap_masks
 
 ##############################################
 ########### Core functions ###################
 ##############################################
 
+def popcount(masks):
+    # number of set bits of each entry of a uint32 array
+    return np.unpackbits(masks.view(np.uint8)).reshape(len(masks), 32).sum(axis=1)
+
 num_alts = 14
 k = 7
+
+# Gurobi parameters, tune together with num_alts
+METHOD = 1 # dual simplex instead of the concurrent default
+PRESOLVE = 1 # conservative presolve
+THREADS = 1
+MIP_FOCUS = 1 # we only care whether a feasible solution exists
+
 A = tuple(range(num_alts))
-ballots = sorted(powerset(A))
+ballot_masks = powerset_masks(num_alts)
 committee = tuple(A[:k])
+committee_mask = to_mask(committee)
+ballot_arr = np.array(ballot_masks, dtype=np.uint32)
+harmonic_lut = np.array(HARMONIC_NUMBERS[:k + 1])
+
+# one environment without log output, shared by all models of a run
+env = Env(empty=True)
+env.setParam("OutputFlag", 0)
+env.start()
 
-m = Model()
+m = Model(env=env)
+m.Params.Method = METHOD
+m.Params.Presolve = PRESOLVE
+m.Params.Threads = THREADS
+m.Params.MIPFocus = MIP_FOCUS
 
-freq = {ballot: m.addVar(ub=1) for ballot in ballots}
-m.addConstr(quicksum(freq[ballot] for ballot in ballots) == 1)
+freq = {ballot_mask: m.addVar(ub=1) for ballot_mask in ballot_masks}
+freq_list = [freq[ballot_mask] for ballot_mask in ballot_masks]
+m.addConstr(quicksum(freq_list) == 1)
 
 MARGIN = 0.1 / (k * k)
 
-for bad_committee in committees_obtained_by_swap(A, committee):
-    m.addConstr(
-        quicksum(
-            freq[ballot] * \
-            (harmonic_number(utility(ballot, committee))) 
-            for ballot in ballots)
-        >= quicksum(
-            freq[ballot] * \
-            (harmonic_number(utility(ballot, bad_committee)))
-            for ballot in ballots) - MARGIN
-    )
+# PAV score contribution of each ballot, as coefficients aligned with freq_list
+committee_utilities = popcount(ballot_arr & committee_mask)
+good_coeffs = harmonic_lut[committee_utilities]
+for bad_committee_mask in committees_obtained_by_swap_masks(A, committee_mask):
+    bad_coeffs = harmonic_lut[popcount(ballot_arr & bad_committee_mask)]
+    m.addConstr(LinExpr((good_coeffs - bad_coeffs).tolist(), freq_list) >= -MARGIN)
 
 # Enforce there is successful deviation
 wlog_partition = generate_wlog_partition(A, [committee])
 possible_deviations = [T 
     for ell in range(1, k+1)
-    for T in itertools.combinations(A, ell)
-    if is_wlog(T, wlog_partition) and not set(T) <= set(committee)]
+    for T in canonical_subsets(wlog_partition, ell)
+    if not set(T) <= set(committee)]
+possible_deviation_masks = [to_mask(T) for T in possible_deviations]
 binary_variables = []
-for new_T in possible_deviations:
-    ballots_preferring_T = set(ballot for ballot in ballots if utility(ballot, new_T) > utility(ballot, committee))
+for T_mask in possible_deviation_masks:
+    ballots_preferring_T = np.flatnonzero(popcount(ballot_arr & T_mask) > committee_utilities)
     binary_variable = m.addVar(vtype=GRB.BINARY)
     binary_variables.append(binary_variable)
-    m.addConstr(quicksum(freq[ballot] for ballot in ballots_preferring_T) >= (len(new_T) / k) * binary_variable)
+    m.addConstr(LinExpr([1.0] * len(ballots_preferring_T), [freq_list[i] for i in ballots_preferring_T])
+        >= (T_mask.bit_count() / k) * binary_variable)
 m.addConstr(quicksum(binary_variables) >= 1)
 
 m.optimize()
 
-if m.SolCount > 0:
-    for ballot in ballots:
-        if freq[ballot].x > 0.001:
-            print(f"{round(freq[ballot].x,3)} {show(ballot)}")
\ No newline at end of file
+if m.Status == GRB.INFEASIBLE:
+    print(f"Model is infeasible for num_alts = {num_alts}, k = {k} and margin {MARGIN:g}")
+elif m.SolCount == 0:
+    # e.g. INF_OR_UNBD, TIME_LIMIT or INTERRUPTED: the log is off, so report the status here
+    print(f"No result for num_alts = {num_alts}, k = {k} and margin {MARGIN:g}: Gurobi status {m.Status}")
+else:
+    print(f"Found a profile for num_alts = {num_alts}, k = {k} and margin {MARGIN:g}:")
+    for ballot_mask in sorted(ballot_masks, key=from_mask):
+        if freq[ballot_mask].x > 0.001:
+            print(f"{round(freq[ballot_mask].x,3)} {show(from_mask(ballot_mask))}")
\ No newline at end of file
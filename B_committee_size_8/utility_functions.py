@@ -9,10 +9,19 @@ def powerset(iterable):
   xs = list(iterable)
   return itertools.chain.from_iterable(itertools.combinations(xs,n) for n in range(1,len(xs)))
 
+def powerset_masks(n):
+    # the sets of powerset(range(n)) as bitmasks, i.e. all sets except the empty and the full one
+    return range(1, (1 << n) - 1)
+
 def show(ballot):
     return "".join(str(a) for a in ballot)
 
 def generate_wlog_partition(A, identifiable_sets):
+    # the partition only depends on the collection of identifiable sets, so canonicalize it for the cache
+    return _generate_wlog_partition(tuple(A), frozenset(frozenset(s) for s in identifiable_sets))
+
+@lru_cache(maxsize=10000)
+def _generate_wlog_partition(A, identifiable_sets):
     partition = []
     for inclusions in itertools.product([True, False], repeat=len(identifiable_sets)):
         partition_block = []
@@ -20,33 +29,63 @@ def generate_wlog_partition(A, identifiable_sets):
             if all((x in identifiable_set) == inclusion for inclusion, identifiable_set in zip(inclusions, identifiable_sets)):
                 partition_block.append(x)
         if partition_block:
-            partition.append(partition_block)
-    return partition
+            partition.append(tuple(sorted(partition_block)))
+    if __debug__:
+        # checked once per partition here, so that is_wlog can rely on it
+        assert all(not set(block1) & set(block2) for block1, block2 in itertools.combinations(partition, 2)) # disjoint
+        assert sum(len(block) for block in partition) == len(set(A)) # covers A
+    return tuple(partition)
 
 def is_wlog(xs, partition):
     # given a partition of a ground set such that in each block of the partition, the elements are indistinguishable,
-    # check that xs is a wlog selection of elements from the ground set
-    sorted_partition = [sorted(block) for block in partition]
-    assert all(not set(block1) & set(block2) for block1, block2 in itertools.combinations(sorted_partition, 2)) # disjoint
-    number_from_block = [len(set(block) & set(xs)) for block in sorted_partition]
-    assert sum(number_from_block) == len(xs) # partition covers xs
-    wlog_selections = [block[:num] for block, num in zip(sorted_partition, number_from_block)]
-    wlog_selection = sorted(itertools.chain(*wlog_selections))
-    return wlog_selection == sorted(xs)
+    # check that xs is a wlog selection of elements from the ground set, i.e. that it selects a prefix of each block
+    # (blocks must be sorted, as returned by generate_wlog_partition)
+    xs_set = set(xs)
+    for block in partition:
+        in_prefix = True
+        for x in block:
+            if x in xs_set:
+                if not in_prefix:
+                    return False
+            else:
+                in_prefix = False
+    assert xs_set.issubset(itertools.chain(*partition)) # partition covers xs
+    return True
+
+def canonical_subsets(partition, ell):
+    # the sets xs of size ell with is_wlog(xs, partition), generated directly by choosing how many
+    # elements to take from each block and taking the smallest ones (blocks must be sorted)
+    if not partition:
+        if ell == 0:
+            yield ()
+        return
+    first_block, other_blocks = partition[0], partition[1:]
+    for num in range(min(len(first_block), ell) + 1):
+        for xs in canonical_subsets(other_blocks, ell - num):
+            yield tuple(sorted(tuple(first_block[:num]) + xs))
+
+# HARMONIC_NUMBERS[r] is the r-th harmonic number, for all utilities r that can occur
+HARMONIC_NUMBERS = tuple(sum(1/i for i in range(1,r+1)) for r in range(64))
 
-@lru_cache(maxsize=10000)
 def harmonic_number(r):
-    return sum(1/i for i in range(1,r+1))
+    return HARMONIC_NUMBERS[r]
+
+def to_mask(xs):
+    # encode a set of alternatives as an int whose bit x is set iff x is in xs
+    return sum(1 << x for x in xs)
+
+def from_mask(mask):
+    return tuple(x for x in range(mask.bit_length()) if mask >> x & 1)
+
+@lru_cache(maxsize=None)
+def cached_mask(xs):
+    # to_mask for hashable xs (ballots, committees), encoded only on first use
+    return to_mask(xs)
 
-@lru_cache(maxsize=10000)
 def utility(ballot, committee):
-    # return len(set(ballot) & set(committee))
-    utility = 0
-    ballot_set = set(ballot)
-    for x in committee:
-        if x in ballot_set:
-            utility += 1
-    return utility
+    # same as len(set(ballot) & set(committee)); hot loops should precompute
+    # the masks and use (ballot_mask & committee_mask).bit_count() directly
+    return (cached_mask(ballot) & cached_mask(committee)).bit_count()
 
 @lru_cache(maxsize=10000)
 def symmetric_difference(com1, com2):
@@ -62,6 +101,12 @@ def committees_obtained_by_swap(A, committee):
                 obtained_committees.append(tuple(sorted(obtained_committee)))
     return obtained_committees
 
+def committees_obtained_by_swap_masks(A, committee_mask):
+    # same as committees_obtained_by_swap, but on bitmasks: remove x and add y by flipping their bits
+    return [committee_mask ^ (1 << x) ^ (1 << y)
+        for x in A if committee_mask >> x & 1
+        for y in A if not committee_mask >> y & 1]
+
 @lru_cache(maxsize=10000)
 def swaps(A, committee):
     all_swaps = []
@@ -4,14 +4,18 @@ import itertools
 import sys
 import os
 import pickle
-from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from utility_functions import powerset, generate_wlog_partition, is_wlog
+from utility_functions import generate_wlog_partition, canonical_subsets
 
-def get_continuations(k, history):
+def canonical_history(history):
+    # committees and deviations as sorted tuples, the form of the keys of info
+    return tuple((tuple(sorted(committee)), tuple(sorted(T))) for committee, T in history)
+
+def get_continuations(A, k, history):
     """
     Parameters:
-        num_alts: number of alternatives
+        A: the alternatives
         k: committee size
         history: list of tuples (committee, T) where T is a core objection to committee
             note that committee must contain all prior T's
@@ -19,57 +23,73 @@ def get_continuations(k, history):
         list of tuples (committee, T) where T might be a core objection to committee
     """
     past_deviations = set().union(*[set(T) for _, T in history])
-    remaining_candidates = set(A) - past_deviations
     places_to_fill = k - len(past_deviations)
     assert places_to_fill >= 0
     # generate based on a list of all past committees and deviations
     wlog_partition = generate_wlog_partition(A, [T for _, T in history] + [committee for committee, _ in history])
-    possible_new_committees = [tuple(past_deviations | set(newcomers)) for newcomers in itertools.combinations(remaining_candidates, places_to_fill) if is_wlog(newcomers, wlog_partition)]
+    # past deviations are unions of blocks, so newcomers are chosen from the remaining blocks
+    remaining_blocks = [block for block in wlog_partition if past_deviations.isdisjoint(block)]
+    possible_new_committees = [tuple(sorted(past_deviations | set(newcomers))) for newcomers in canonical_subsets(remaining_blocks, places_to_fill)]
 
-    new_histories = []
+    steps = []
     for new_committee in possible_new_committees:
         wlog_partition = generate_wlog_partition(A, [T for _, T in history] + [committee for committee, _ in history] + [new_committee])
         possible_deviations = [T 
             for ell in range(1, k+1)
-            for T in itertools.combinations(A, ell)
-            if is_wlog(T, wlog_partition) and not set(T) <= set(new_committee)]
+            for T in canonical_subsets(wlog_partition, ell)
+            if not set(T) <= set(new_committee)]
         
         for T in possible_deviations:
-            new_histories.append(history + ((new_committee, T),))
+            steps.append((new_committee, T))
+
+    return steps
 
-    return new_histories
+def run(A, k, info):
+    # depth-first search like a plain stack, but the top histories of the stack are expanded in
+    # batches in parallel; workers only return the new steps, which are appended to the histories here.
+    # There is no need to remember histories to skip relabelings of them: a relabeling of the alternatives
+    # that maps one history to another must fix their common prefix, i.e. only permute within the blocks
+    # of its wlog partition, and get_continuations generates one step per orbit of these permutations.
+    # So by induction on the length, no two histories visited here are isomorphic.
+    stack = [()] # empty history
 
-def run(k, info):
-    queue = deque()
+    with ProcessPoolExecutor(8) as executor:
+        while stack:
+            histories_to_expand = []
+            while stack and len(histories_to_expand) < 8 * 32:
+                history = stack.pop()
+                assert history in info
+                if "farkas" not in info[history]:
+                    histories_to_expand.append(history)
 
-    queue.append(()) # empty history
+            continuations = executor.map(get_continuations, itertools.repeat(A), itertools.repeat(k), histories_to_expand, chunksize=8)
+            for history, steps in zip(histories_to_expand, continuations):
+                for step in steps:
+                    new_history = history + (step,)
+                    assert new_history in info
+                    if info[new_history]["successful"]:
+                        stack.append(new_history)
+                    else:
+                        assert "farkas" in info[new_history]
 
-    while queue:
-        history = queue.pop()
-        assert history in info
-        if "farkas" in info[history]:
-            continue
-        for new_history in get_continuations(k, history):
-            assert new_history in info
-            if info[new_history]["successful"]:
-                queue.append(new_history)
-            else:
-                assert "farkas" in info[new_history]
+if __name__ == "__main__":
 
-if len(sys.argv) not in [2, 3]:
-    print("Usage: python3 farkas-check-complete.py num_alts [k]")
-    sys.exit()
+    if len(sys.argv) not in [2, 3]:
+        print("Usage: python3 farkas-check-complete.py num_alts [k]")
+        sys.exit()
 
-num_alts = int(sys.argv[1])
-A = range(num_alts)
-ballots = sorted(powerset(A))
+    num_alts = int(sys.argv[1])
+    A = range(num_alts)
 
-ks = range(8, num_alts-1) if len(sys.argv) == 2 else [int(sys.argv[2])]
+    ks = range(8, num_alts-1) if len(sys.argv) == 2 else [int(sys.argv[2])]
 
-for k in ks:
-    if os.path.exists(f"results/{num_alts}/info-{num_alts}-{k}.pkl"):
-        info = pickle.load(open(f"results/{num_alts}/info-{num_alts}-{k}.pkl", "rb"))
-        print(f"Loaded info for num_alts = {num_alts}, k = {k}")
-        run(k, info)
-    else:
-        print(f"No info for num_alts = {num_alts}, k = {k}")
\ No newline at end of file
+    for k in ks:
+        if os.path.exists(f"results/{num_alts}/info-{num_alts}-{k}.pkl"):
+            info = pickle.load(open(f"results/{num_alts}/info-{num_alts}-{k}.pkl", "rb"))
+            print(f"Loaded info for num_alts = {num_alts}, k = {k}")
+            # make sure lookups of generated histories match the keys regardless of how they were stored
+            canonical_info = {canonical_history(history): value for history, value in info.items()}
+            assert len(canonical_info) == len(info)
+            run(A, k, canonical_info)
+        else:
+            print(f"No info for num_alts = {num_alts}, k = {k}")
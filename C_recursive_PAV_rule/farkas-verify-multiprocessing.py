@@ -1,71 +1,155 @@
 # check Farkas certificates are correct for unsuccessful histories
 
 import itertools
+import math
 import sys
 import os
 from functools import lru_cache
 import pickle
 from tqdm import tqdm
 from multiprocessing import Pool
+import numpy as np
+from numba import njit
 
 # from fractions import Fraction
 from gmpy2 import mpq as Fraction
 
-from utility_functions import powerset, utility, swaps
+from utility_functions import powerset_masks, to_mask, swaps
 
 ##############################################
 ########### Core functions ###################
 ##############################################
 
-def check_farkas_for_history(A, ballots, k, history, farkas):
+def int64_arrays(steps, gamma_num):
+    # flatten the history steps (see check_farkas_for_history) into int64 arrays for ballots_satisfied
+    width = max([1] + [len(nonzero_betas) for _, _, nonzero_betas in steps])
+    committee_masks = np.array([committee_mask for committee_mask, _, _ in steps], dtype=np.int64)
+    T_masks = np.array([T_mask for _, T_mask, _ in steps], dtype=np.int64)
+    beta_count = np.zeros(len(steps), dtype=np.int64)
+    beta_x = np.zeros((len(steps), width), dtype=np.int64)
+    beta_y = np.zeros((len(steps), width), dtype=np.int64)
+    beta_val = np.zeros((len(steps), width), dtype=np.int64)
+    for history_time, (_, _, nonzero_betas) in enumerate(steps):
+        beta_count[history_time] = len(nonzero_betas)
+        for i, (x, y, value) in enumerate(nonzero_betas):
+            beta_x[history_time, i] = x
+            beta_y[history_time, i] = y
+            beta_val[history_time, i] = value
+    return committee_masks, T_masks, beta_count, beta_x, beta_y, beta_val, np.array(gamma_num, dtype=np.int64)
+
+@njit(cache=True)
+def popcount(x):
+    count = 0
+    while x:
+        x &= x - 1
+        count += 1
+    return count
+
+@njit(cache=True)
+def ballots_satisfied(ballot_masks, alpha_num, committee_masks, T_masks, beta_count, beta_x, beta_y, beta_val, gamma_num, inv_u):
+    # same loop as the exact fallback in check_farkas_for_history, on int64 arrays
+    for ballot_mask in ballot_masks:
+        lhs = alpha_num
+        for history_time in range(len(committee_masks)):
+            committee_utility = popcount(ballot_mask & committee_masks[history_time])
+            for i in range(beta_count[history_time]):
+                x_approved = ballot_mask >> beta_x[history_time, i] & 1
+                y_approved = ballot_mask >> beta_y[history_time, i] & 1
+                if x_approved and not y_approved:
+                    lhs -= beta_val[history_time, i] * inv_u[committee_utility]
+                if not x_approved and y_approved:
+                    lhs += beta_val[history_time, i] * inv_u[committee_utility + 1]
+            if popcount(ballot_mask & T_masks[history_time]) > committee_utility:
+                lhs -= gamma_num[history_time]
+                break
+        if lhs < 0:
+            return False
+    return True
+
+def scale(q, denominator):
+    # numerator of the rational q when written over the given common denominator
+    return int(q.numerator) * (denominator // int(q.denominator))
+
+def check_farkas_for_history(A, ballot_masks, k, history, farkas):
 
     alpha = farkas["alpha"]
     beta = farkas["beta"]
     gamma = farkas["gamma"]
 
-    for ballot in ballots:
-        ballot_set = set(ballot)
-
-        lhs = alpha
-        for history_time in range(len(history)):
-            committee, T = history[history_time]
-
-            # beta terms
-            for x, y in swaps(A, committee):
-                if beta[history_time, x, y] != 0:
-                    if x in ballot_set and y not in ballot_set:
+    # All terms are of the form alpha, beta / u or gamma with u in 1..k+1. Writing everything
+    # over the common denominator lcm(1..k+1) * D, where D is a common denominator of the witness,
+    # the check for each ballot becomes exact integer arithmetic.
+    beta = {(history_time, x, y): beta[history_time, x, y]
+        for history_time, (committee, _) in enumerate(history) for x, y in swaps(A, committee)}
+    gamma = [gamma[history_time] for history_time in range(len(history))]
+    L = math.lcm(*range(1, k + 2))
+    D = math.lcm(*(int(q.denominator) for q in [alpha, *beta.values(), *gamma]))
+    inv_u = [0] + [L // u for u in range(1, k + 2)] # inv_u[u] * D = (L * D) / u
+    alpha_num = scale(alpha, L * D)
+    beta_num = {key: scale(value, D) for key, value in beta.items()}
+    gamma_num = [scale(value, L * D) for value in gamma]
+
+    # per history step, the committee and T as masks and the swaps (x, y) with nonzero beta,
+    # so that the ballot loops below do not need to look at the other swaps
+    steps = [(to_mask(committee), to_mask(T),
+        [(x, y, beta_num[history_time, x, y]) for x, y in swaps(A, committee) if beta_num[history_time, x, y] != 0])
+        for history_time, (committee, T) in enumerate(history)]
+
+    # the compiled loop is only used if no partial sum can overflow int64
+    bound = abs(alpha_num) + sum(abs(value) for value in gamma_num) + L * sum(abs(value) for value in beta_num.values())
+    if bound < 2**63:
+        assert ballots_satisfied(np.asarray(ballot_masks, dtype=np.int64), alpha_num, *int64_arrays(steps, gamma_num), np.array(inv_u, dtype=np.int64))
+    else:
+        for ballot_mask in map(int, ballot_masks):
+
+            lhs = alpha_num
+            for history_time, (committee_mask, T_mask, nonzero_betas) in enumerate(steps):
+                committee_utility = (ballot_mask & committee_mask).bit_count()
+
+                # beta terms
+                for x, y, value in nonzero_betas:
+                    x_approved = ballot_mask >> x & 1
+                    y_approved = ballot_mask >> y & 1
+                    if x_approved and not y_approved:
                         # utility went down, lost 1/utility
-                        lhs += -beta[history_time, x, y] * Fraction(1, utility(ballot, committee))
-                    if x not in ballot_set and y in ballot_set:
+                        lhs -= value * inv_u[committee_utility]
+                    if not x_approved and y_approved:
                         # utility went up, gained 1/(utility + 1)
-                        lhs += beta[history_time, x, y] * Fraction(1, utility(ballot, committee) + 1)
+                        lhs += value * inv_u[committee_utility + 1]
 
-            # gamma terms
-            if utility(ballot, T) > utility(ballot, committee):
-                lhs -= gamma[history_time]
-                break # ballot becomes inactive
-            
-        assert lhs >= 0
+                # gamma terms
+                if (ballot_mask & T_mask).bit_count() > committee_utility:
+                    lhs -= gamma_num[history_time]
+                    break # ballot becomes inactive
+                
+            assert lhs >= 0
 
     assert alpha - sum(Fraction(len(T), k) * gamma[history_time] for history_time, (_, T) in enumerate(history)) <= -1
 
+def init_worker(A, ballot_masks, k):
+    # data shared by all tasks is sent to each worker process once, not with every task
+    global worker_data
+    worker_data = (A, ballot_masks, k)
+
 def worker(args):
-    A, ballots, k, history, farkas = args
+    history, farkas = args
+    A, ballot_masks, k = worker_data
     
-    check_farkas_for_history(A, ballots, k, history, farkas)
+    check_farkas_for_history(A, ballot_masks, k, history, farkas)
     return True
 
 def run(num_alts, k, info):
     A = range(num_alts)
-    ballots = sorted(powerset(A))
+    ballot_masks = np.array(powerset_masks(num_alts), dtype=np.int64)
 
     unsuccessful_histories = [history for history in info if not info[history]["successful"]]
     
-    with Pool(8) as pool:
-        args = [(A, ballots, k, history, info[history]["farkas"]) for history in unsuccessful_histories]
+    with Pool(8, initializer=init_worker, initargs=(A, ballot_masks, k)) as pool:
+        # tasks are generated lazily as the pool consumes them
+        args = ((history, info[history]["farkas"]) for history in unsuccessful_histories)
         results = list(tqdm(
-            pool.imap_unordered(worker, args),
-            total=len(args),
+            pool.imap_unordered(worker, args, chunksize=max(1, len(unsuccessful_histories) // (8 * 4))),
+            total=len(unsuccessful_histories),
             desc=f"    m={num_alts}, k={k}"
         ))
     return all(results)